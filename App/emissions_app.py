@@ -1,3 +1,7 @@
+import os
+import time
+import hashlib
+
 import streamlit as st
 import pandas as pd
 import snowflake.connector
@@ -5,77 +9,80 @@ import plotly.graph_objects as go
 
 st.title('Carbon Intensity Comparison')
 
+# Local parquet copies of query results, so a cold start (new process,
+# empty st.cache_data) does not have to hit the warehouse again.
+PARQUET_CACHE_DIR = os.path.join(os.path.dirname(__file__), '.parquet_cache')
+PARQUET_CACHE_TTL = 24 * 60 * 60
+
 
 # Initialize connection.
-# Uses st.experimental_singleton to only run once.
-@st.experimental_singleton
+# Uses st.cache_resource to only run once.
+@st.cache_resource
 def init_connection():
     return snowflake.connector.connect(
-        **st.secrets["snowflake"], client_session_keep_alive=True
+        **st.secrets["snowflake"], client_session_keep_alive=True,
+        session_parameters={'PYTHON_CONNECTOR_QUERY_RESULT_FORMAT': 'ARROW'}
     )
 
 
 conn = init_connection()
 
 
-@st.experimental_memo
+@st.cache_data(ttl=24 * 60 * 60)
 def fetch_sql_df(sql: str) -> pd.DataFrame:
     """
-    query snowflake and return the result as a dataframe
+    query snowflake and return the result as a dataframe,
+    keeping a parquet copy on disk for cold starts
     """
+    os.makedirs(PARQUET_CACHE_DIR, exist_ok=True)
+    cache_path = os.path.join(PARQUET_CACHE_DIR, hashlib.sha256(sql.encode()).hexdigest() + '.parquet')
+    if os.path.exists(cache_path) and time.time() - os.path.getmtime(cache_path) < PARQUET_CACHE_TTL:
+        return pd.read_parquet(cache_path)
     with conn.cursor() as curr:
         curr = curr.execute(sql)
-        results = curr.fetchall()
-        cols = [c[0].lower() for c in curr.description]
-        return pd.DataFrame(results, columns=cols)
+        df = curr.fetch_pandas_all()
+        df.columns = df.columns.str.lower()
+        df.to_parquet(cache_path)
+        return df
 
 
-@st.cache(ttl=24 * 60 * 60)
-def load_data_1():
-    sql_query_1 = 'SELECT emaps_carbonintensity_timestamp,emaps_carbonintensity_zone,' \
-                  'carbon_intensity_tons_per_mwh  FROM "CASESTUDY_GARETH"."average_carbon_intensity";'
+@st.cache_data(ttl=24 * 60 * 60)
+def load_data_1(granularity: str):
+    sql_query_1 = 'SELECT DATE_TRUNC(\'%s\', CONVERT_TIMEZONE(\'UTC\', \'US/Pacific\', emaps_carbonintensity_timestamp)) ' \
+                  'AS datetime,AVG(carbon_intensity_tons_per_mwh) AS carbon_intensity_tons_per_mwh ' \
+                  'FROM "CASESTUDY_GARETH"."average_carbon_intensity" GROUP BY 1 ORDER BY 1;' % granularity
     df1 = fetch_sql_df(sql_query_1)
-    df1['datetime'] = df1['emaps_carbonintensity_timestamp']
+    df1['carbon_intensity_tons_per_mwh'] = df1['carbon_intensity_tons_per_mwh'].astype('float32')
     df1.set_index(['datetime'], inplace=True)
     return df1
 
 
-@st.cache(ttl=24 * 60 * 60)
-def load_data_2():
-    sql_query_2 = 'SELECT moers_timestamp,moer_tons_per_mwh,wattime_balancing_authority ' \
-                  'FROM "CASESTUDY_GARETH"."marginal_operating_emissions_rate";'
+@st.cache_data(ttl=24 * 60 * 60)
+def load_data_2(granularity: str):
+    sql_query_2 = 'SELECT DATE_TRUNC(\'%s\', CONVERT_TIMEZONE(\'UTC\', \'US/Pacific\', moers_timestamp)) ' \
+                  'AS datetime,AVG(moer_tons_per_mwh) AS moer_tons_per_mwh ' \
+                  'FROM "CASESTUDY_GARETH"."marginal_operating_emissions_rate" GROUP BY 1 ORDER BY 1;' % granularity
     df2 = fetch_sql_df(sql_query_2)
-    df2['datetime'] = df2['moers_timestamp']
+    df2['moer_tons_per_mwh'] = df2['moer_tons_per_mwh'].astype('float32')
     df2.set_index(['datetime'], inplace=True)
     return df2
 
 
-@st.cache(ttl=24 * 60 * 60, show_spinner=False)
 def aggregate_data(df1, df2):
-    df3 = pd.concat([df1, df2], copy=False).sort_values(by='datetime')
-    df3.index = pd.to_datetime(df3.index, utc=True)
-    df3.index = df3.index.tz_convert("US/Pacific")
-    df3 = df3.fillna(method='bfill')
+    df3 = pd.merge_asof(df1.reset_index(), df2.reset_index(), on='datetime', direction='backward')
+    df3.set_index(['datetime'], inplace=True)
     return df3
 
 
-@st.cache(ttl=24 * 60 * 60, show_spinner=False)
-def get_aggregated_data(data, target: str):
-    df = data.groupby(pd.Grouper(freq=target)).mean()
-    df['delta_marginal_vs_average_tons_per_mwh'] = df['moer_tons_per_mwh'] - df['carbon_intensity_tons_per_mwh']
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def get_aggregated_data(granularity: str):
+    df = aggregate_data(load_data_1(granularity), load_data_2(granularity))
+    df['delta_marginal_vs_average_tons_per_mwh'] = \
+        df['moer_tons_per_mwh'].to_numpy() - df['carbon_intensity_tons_per_mwh'].to_numpy()
     return df
 
 
-data_load_state = st.text('Loading data...')
-df1 = load_data_1()
-df2 = load_data_2()
-data = aggregate_data(df1, df2)
-time_data = get_aggregated_data(data, 'M')
-data_load_state.text("Done!")
-
-if st.checkbox('Show raw data'):
-    st.subheader('Raw data')
-    st.write(time_data)
+option_map = {'Week': 'WEEK', 'Month': 'MONTH', 'Year': 'YEAR'}
 
 st.header('Carbon Intensity')
 st.caption('This plot compares average carbon intensity to marginal operating emissions rate')
@@ -86,31 +93,34 @@ st.caption('-- i.e. we need to use more non-renewables to generate more power ')
 option = st.selectbox(
     'What timeframe would you like to view the data on?',
     ('Week', 'Month', 'Year'), key='1')
-option_map = {'Week': 'W', 'Month': 'M', 'Year': 'Y'}
-time_data = get_aggregated_data(data, option_map[option])
+data_load_state = st.text('Loading data...')
+time_data = get_aggregated_data(option_map[option])
+data_load_state.text("Done!")
 # st.area_chart(time_data, y=['moer_tons_per_mwh', 'carbon_intensity_tons_per_mwh'])
 
+if st.checkbox('Show raw data'):
+    st.subheader('Raw data')
+    st.write(time_data)
+
 fig = go.Figure()
-fig.add_trace(go.Scatter(x=time_data.index, y=time_data['moer_tons_per_mwh'], name='moer_tons_per_mwh',
-                         fill='tonexty', mode='none'))
-fig.add_trace(go.Scatter(x=time_data.index, y=time_data['carbon_intensity_tons_per_mwh'],
-                         name='carbon_intensity_tons_per_mwh',
-                         fill='tozeroy', mode='none'))
-fig.update_xaxes(
-    title_text='Time Frame',
-    # title_font=dict(size=16, family='Verdana', color='black'))
-)
-fig.update_yaxes(
-    title_text="tons/mWh",
-    # title_font=dict(size=30, family='Verdana', color='black'))
-)
-fig.update_layout(legend=dict(
-    orientation="h",
-    yanchor="top",
-    y=-0.2,
-    xanchor="left",
-    x=0
-))
+# WebGL for large series; SVG renders small filled areas more cleanly
+scatter_cls = go.Scattergl if len(time_data) >= 5000 else go.Scatter
+timestamps = time_data.index.to_numpy().astype('datetime64[ms]')
+fig.add_trace(scatter_cls(x=timestamps, y=time_data['moer_tons_per_mwh'].to_numpy(), name='moer_tons_per_mwh',
+                          fill='tonexty', mode='none'))
+fig.add_trace(scatter_cls(x=timestamps, y=time_data['carbon_intensity_tons_per_mwh'].to_numpy(),
+                          name='carbon_intensity_tons_per_mwh',
+                          fill='tozeroy', mode='none'))
+fig.update_layout(
+    xaxis=dict(title_text='Time Frame'),
+    yaxis=dict(title_text="tons/mWh"),
+    legend=dict(
+        orientation="h",
+        yanchor="top",
+        y=-0.2,
+        xanchor="left",
+        x=0
+    ))
 
 st.plotly_chart(
     fig,
@@ -124,5 +134,5 @@ st.caption('- i.e. when is the least sustainable time to use additional energy')
 option_1 = st.selectbox(
     'What timeframe would you like to view the data on?',
     ('Week', 'Month', 'Year'), key='2')
-time_data = get_aggregated_data(data, option_map[option_1])
-st.area_chart(time_data, y=['delta_marginal_vs_average_tons_per_mwh'])
+delta_data = time_data if option_1 == option else get_aggregated_data(option_map[option_1])
+st.area_chart(delta_data, y=['delta_marginal_vs_average_tons_per_mwh'])